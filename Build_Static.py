@@ -0,0 +1,244 @@
+"""
+網頁前端的靜態檔案建置：
+- index.html 引用的 marked、KaTeX、highlight.js 放在 static/vendor/（已經放進 git，不依賴 CDN）
+- 所有檔案（圖片、字型、CSS、JS）加上內容雜湊的檔名，輸出到 static/dist/，可以長期快取
+- 預先產生 gzip（以及有安裝 brotli 時的 br）壓縮版本
+- 有安裝 Pillow 時重新壓縮背景圖片，並另外產生 WebP 版本（瀏覽器支援時由伺服器改送）
+- 印出建置前後的頁面大小
+
+執行方式：
+    python Build_Static.py           # 每次修改 static/ 之後重新建置
+    python Build_Static.py --fetch   # static/vendor/ 有檔案遺失時，先從 jsDelivr 補下載（下載失敗只會警告，照常建置）
+    python Build_Static.py --fetch --mirror https://unpkg.com   # jsDelivr 連不到時改用目錄結構相同的 npm 鏡像站
+"""
+import os
+import re
+import io
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+import posixpath
+import urllib.request
+from urllib.parse import urljoin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = "static"
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+VENDOR_DIR = os.path.join(STATIC_DIR, "vendor")
+STATIC_URL = "/static/"
+DIST_URL = "/static/dist/"
+
+NPM_CDN = "https://cdn.jsdelivr.net/npm"
+# static/vendor/ 裡的檔案 -> npm 套件裡的路徑（--fetch 補下載時使用）
+VENDOR_FILES = {
+    "marked/marked.js": "marked@4.0.19/lib/marked.umd.js",
+    "katex/katex.min.js": "katex@0.16.8/dist/katex.min.js",
+    "katex/katex.min.css": "katex@0.16.8/dist/katex.min.css",
+    "highlight/highlight.min.js": "@highlightjs/cdn-assets@11.8.0/highlight.min.js",
+    "highlight/github.min.css": "@highlightjs/cdn-assets@11.8.0/styles/github.min.css",
+}
+
+COMPRESSIBLE = {".html", ".css", ".js", ".svg", ".json", ".txt"}    # 圖片和 woff2 本身已經壓縮過
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+IMAGE_MAX_WIDTH = 1920
+JPEG_QUALITY = 80
+WEBP_QUALITY = 80
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+HTML_REF = re.compile(r"""(src|href)="([^"]+)\"""")
+
+
+def fetch_vendor(mirror=None):
+    """
+    補下載 static/vendor/ 裡遺失的第三方套件（已存在的檔案不會重新下載），KaTeX 只下載 woff2 字型
+    mirror 是和 jsDelivr 的 /npm 相同目錄結構的網址（例如 https://unpkg.com，也可以是 file:// 開頭的本機目錄）
+    下載失敗的檔案只印出警告，回傳失敗的數量
+    """
+    base = (mirror or NPM_CDN).rstrip("/")
+    failed = 0
+    for rel_path, npm_path in VENDOR_FILES.items():
+        url = f"{base}/{npm_path}"
+        path = os.path.join(VENDOR_DIR, rel_path)
+        if not os.path.exists(path) and not download(url, path):
+            failed += 1
+            continue
+        if path.endswith(".css"):
+            with open(path, encoding="utf-8") as f:
+                css = f.read()
+            for _, ref in CSS_URL.findall(css):
+                if not ref.endswith(".woff2") or ref.startswith(("data:", "/", "http")):
+                    continue
+                font_path = os.path.normpath(os.path.join(os.path.dirname(path), ref))
+                if not os.path.exists(font_path) and not download(urljoin(url, ref), font_path):
+                    failed += 1
+    if failed:
+        print(f"警告：有 {failed} 個第三方檔案下載失敗，網頁會以純文字顯示回答（可以用 --mirror 指定其他來源後重試）")
+    return failed
+
+
+def download(url, path):
+    """下載一個檔案，失敗時印出警告並回傳 False（不會留下不完整的檔案）"""
+    print(f"下載 {url}")
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+    except (OSError, ValueError) as e:     # URLError、逾時、連線錯誤，以及格式錯誤的鏡像站網址
+        print(f"警告：{url} 下載失敗：{e}")
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+def load_image(data):
+    image = Image.open(io.BytesIO(data))
+    if image.width > IMAGE_MAX_WIDTH:
+        image = image.resize((IMAGE_MAX_WIDTH, round(image.height * IMAGE_MAX_WIDTH / image.width)), Image.LANCZOS)
+    return image
+
+
+def optimize_image(data, ext):
+    """縮小過大的圖片並重新壓縮成漸進式 JPEG，沒有 Pillow 或結果沒有比較小就用原檔"""
+    if Image is None or ext not in (".jpg", ".jpeg"):
+        return data
+    output = io.BytesIO()
+    load_image(data).convert("RGB").save(output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return output.getvalue() if output.tell() < len(data) else data
+
+
+def to_webp(data):
+    """轉成 WebP，沒有 Pillow 時回傳 None"""
+    if Image is None:
+        return None
+    output = io.BytesIO()
+    load_image(data).save(output, "WEBP", quality=WEBP_QUALITY, method=6)
+    return output.getvalue()
+
+
+def rewrite_css(css, css_url, manifest):
+    """把 CSS 裡的 url(...) 換成雜湊後的網址；找不到的相對路徑改成原本位置的絕對路徑"""
+    def replace(match):
+        ref = match.group(2)
+        if ref.startswith(("data:", "#")):
+            return match.group(0)
+        absolute = urljoin(css_url, ref)
+        return f"url({manifest.get(absolute, absolute)})"
+    return CSS_URL.sub(replace, css)
+
+
+def rewrite_html(html, manifest):
+    """把 index.html 引用的 /static/ 檔案換成雜湊後的網址"""
+    def replace(match):
+        attribute, ref = match.groups()
+        if ref.startswith(STATIC_URL) and ref not in manifest:
+            print(f"警告：index.html 引用的 {ref} 不存在（第三方套件可以用 python Build_Static.py --fetch 補下載）")
+        return f'{attribute}="{manifest.get(ref, ref)}"'
+    return HTML_REF.sub(replace, html)
+
+
+def write_output(rel_path, data):
+    """寫出檔案以及比原檔小的 gzip / br / WebP 版本，回傳實際傳輸時最小的大小"""
+    path = os.path.join(DIST_DIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+    ext = os.path.splitext(rel_path)[1].lower()
+    variants = {}
+    if ext in COMPRESSIBLE:
+        variants[".gz"] = gzip.compress(data, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+    elif ext in IMAGE_EXTENSIONS:
+        variants[".webp"] = to_webp(data)
+
+    smallest = len(data)
+    for suffix, variant in variants.items():
+        if variant is not None and len(variant) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(variant)
+            smallest = min(smallest, len(variant))
+    return smallest
+
+
+def hashed_name(rel_path, data):
+    stem, ext = posixpath.splitext(rel_path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def collect_sources():
+    """static/ 底下要建置的檔案（相對路徑），CSS 放最後，因為要先知道圖片與字型的新檔名"""
+    sources = []
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != DIST_DIR]
+        for name in files:
+            rel_path = os.path.relpath(os.path.join(root, name), STATIC_DIR).replace(os.sep, "/")
+            if rel_path != "index.html" and not name.startswith("LICENSE"):
+                sources.append(rel_path)
+    return sorted(sources, key=lambda p: (p.endswith(".css"), p))
+
+
+def build():
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    os.makedirs(DIST_DIR)
+
+    manifest = {}   # 原本的網址 -> 雜湊後的網址
+    report = []     # (檔案, 建置前傳輸大小, 建置後傳輸大小)
+    for rel_path in collect_sources():
+        with open(os.path.join(STATIC_DIR, rel_path), "rb") as f:
+            original = f.read()
+        ext = os.path.splitext(rel_path)[1].lower()
+        data = optimize_image(original, ext)
+        if ext == ".css":
+            data = rewrite_css(data.decode("utf-8"), STATIC_URL + rel_path, manifest).encode("utf-8")
+
+        out_path = hashed_name(rel_path, data)
+        manifest[STATIC_URL + rel_path] = DIST_URL + out_path
+        after = write_output(out_path, data)
+        report.append((rel_path, len(original), after))   # 建置前：直接提供 static/ 裡的原始檔案，沒有壓縮
+
+    with open(os.path.join(STATIC_DIR, "index.html"), encoding="utf-8") as f:
+        html = f.read()
+    original = html.encode("utf-8")
+    after = write_output("index.html", rewrite_html(html, manifest).encode("utf-8"))
+    report.append(("index.html", len(original), after))
+
+    with open(os.path.join(DIST_DIR, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+
+
+def print_report(report):
+    print(f"\n{'檔案':<44}{'建置前':>12}{'建置後':>12}")
+    for rel_path, before, after in report:
+        print(f"{rel_path:<46}{before:>12,}{after:>12,}")
+    total_before = sum(before for _, before, _ in report)
+    total_after = sum(after for _, _, after in report)
+    print(f"{'首次載入總傳輸量（bytes）':<34}{total_before:>12,}{total_after:>12,}")
+    if brotli is None:
+        print("提示：安裝 brotli（pip install brotli）可以額外產生 .br 壓縮檔")
+    if Image is None:
+        print("提示：安裝 Pillow（pip install Pillow）可以重新壓縮圖片")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建置網頁前端的靜態檔案到 static/dist/")
+    parser.add_argument("--fetch", action="store_true", help="先補下載 static/vendor/ 裡遺失的第三方套件（需要網路）")
+    parser.add_argument("--mirror", help="用來取代 jsDelivr 的 npm 鏡像站網址（例如 https://unpkg.com）"),
+    args = parser.parse_args()
+    if args.fetch:
+        fetch_vendor(args.mirror)
+    build()
@@ -0,0 +1,110 @@
+"""
+用本機的假上游伺服器（隨機注入延遲與錯誤）比較：
+- 直接呼叫（目前沒有期限、重試、對沖的情況）
+- 經過 CallPolicy（期限 + 重試 + 對沖請求）
+執行方式：python Latency_Benchmark.py --requests 400
+"""
+import time
+import random
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from Latency_Policy import CallPolicy, RetryBudget
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """模擬語言模型 API：大部分請求很快，少數非常慢或回傳 503"""
+    slow_rate = 0.05        # 多少比例的請求會非常慢
+    slow_seconds = 3.0
+    error_rate = 0.02       # 多少比例的請求回傳 503
+    served = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        with StubHandler.lock:
+            StubHandler.served += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        roll = random.random()
+        if roll < self.error_rate:
+            time.sleep(0.05)
+            self.send_response(503)
+            self.end_headers()
+            return
+        if roll < self.error_rate + self.slow_rate:
+            time.sleep(self.slow_seconds)
+        else:
+            time.sleep(random.uniform(0.04, 0.12))
+        body = b'{"answer": "ok"}'
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # 用戶端已經逾時放棄這個請求
+
+    def log_message(self, format, *args):
+        pass    # 不要把每個請求都印出來
+
+
+def call_stub(url, timeout):
+    """送一個請求給假上游；經過 CallPolicy 時 timeout 由它依剩餘時間決定"""
+    request = urllib.request.Request(url, data=b'{"input": "hi"}', method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def run(label, fn, requests, concurrency):
+    """以 concurrency 個執行緒送出 requests 個請求，印出延遲分佈與失敗數"""
+    StubHandler.served = 0
+    latencies, errors = [], 0
+
+    def one(_):
+        start = time.monotonic()
+        try:
+            fn()
+            return time.monotonic() - start, None
+        except Exception as e:
+            return time.monotonic() - start, e
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, error in pool.map(one, range(requests)):
+            latencies.append(latency)
+            errors += error is not None
+
+    latencies.sort()
+    pick = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+    print(f"{label:<10} p50={pick(50):7.0f}ms  p95={pick(95):7.0f}ms  p99={pick(99):7.0f}ms  "
+          f"max={latencies[-1] * 1000:7.0f}ms  失敗={errors:<3} 上游請求數={StubHandler.served}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在本機假上游伺服器上比較延遲控制前後的尾端延遲")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--deadline", type=float, default=2.0, help="CallPolicy 的期限（秒）")
+    parser.add_argument("--hedge-percentile", type=float, default=95, help="對沖門檻百分位，0 表示關閉")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+
+    random.seed(args.seed)
+    run("直接呼叫", lambda: call_stub(url, timeout=60), args.requests, args.concurrency)
+
+    random.seed(args.seed)
+    policy = CallPolicy("stub", deadline=args.deadline, hedge_percentile=args.hedge_percentile,
+                        retry_budget=RetryBudget(0.2))
+    run("CallPolicy", lambda: policy.call(call_stub, url), args.requests, args.concurrency)
+    print(f"CallPolicy 統計：{policy.stats()}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 各階段的延遲控制設定（可在 .env 調整）
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "30"))               # 產生回答階段最多等幾秒（含重試）
+EMBED_DEADLINE = float(os.getenv("EMBED_DEADLINE", "5"))            # 問題向量化階段最多等幾秒（含重試）
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))              # 每次呼叫最多嘗試幾次
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))  # 重試與對沖請求最多佔正常請求的比例
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0"))        # 超過最近延遲的第幾百分位就送出對沖請求，0 表示關閉（語言模型的對沖請求會重複計費）
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class StageTimeout(TimeoutError):
+    """某個階段超過期限仍沒有結果，stage 是該階段 CallPolicy 的名稱"""
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+
+class AttemptTimeout(TimeoutError):
+    """單次嘗試超過分配到的時間，整個階段還有剩餘時間時會重試"""
+
+
+def is_timeout(error) -> bool:
+    """是否為逾時（自己的單次嘗試逾時，或 client 本身的逾時）"""
+    if isinstance(error, TimeoutError):
+        return True
+    return any(cls.__name__ == "APITimeoutError" for cls in type(error).__mro__)
+
+
+def is_retryable(error) -> bool:
+    """逾時、連線錯誤、429 與 5xx 值得重試；4xx（例如內容過長、金鑰錯誤）重試也沒用"""
+    if isinstance(error, StageTimeout):
+        return False
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    if isinstance(error, OSError):  # TimeoutError、ConnectionError、urllib 的 URLError
+        return True
+    return any(cls.__name__ in ("APITimeoutError", "APIConnectionError") for cls in type(error).__mro__)
+
+
+class RetryBudget:
+    """
+    重試預算：每個正常請求存入 ratio 個令牌，每次重試或對沖請求花掉 1 個，
+    上游出問題時重試量最多只會是正常流量的 ratio 倍，不會把上游壓垮
+    """
+    def __init__(self, ratio=0.2, min_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 100 * ratio)
+        self.tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def available(self) -> int:
+        """目前還能重試幾次"""
+        with self._lock:
+            return int(self.tokens)
+
+
+class LatencyTracker:
+    """記錄最近 window 次成功呼叫的耗時，用來計算對沖門檻"""
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None     # 樣本不足時不對沖
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class CallPolicy:
+    """
+    對一個階段（例如 embedding、語言模型）的呼叫加上：
+    - 整個階段的期限 deadline（含所有重試），超過就丟出 StageTimeout
+    - 每次嘗試最多等「剩餘時間 ÷ 還能嘗試的次數」，並以 timeout_arg 參數把這個時間傳給 fn，
+      讓底層的請求自己逾時結束，卡住的請求不會用掉整個期限、也不會在放棄後繼續佔用上游
+    - 失敗時以 full jitter 指數退避重試，重試次數受 RetryBudget 限制
+    - 對沖請求：等待超過最近延遲的 hedge_percentile 百分位仍未完成時，再送一次相同請求，先回來的為準
+    """
+    def __init__(self, name, deadline, max_attempts=MAX_ATTEMPTS, base_backoff=0.2, max_backoff=2.0,
+                 hedge_percentile=HEDGE_PERCENTILE, retry_budget=None, max_workers=32, timeout_arg="timeout"):
+        self.name = name
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.retry_budget = retry_budget or RetryBudget(RETRY_BUDGET_RATIO)
+        self.timeout_arg = timeout_arg
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-call")
+
+        self._stats_lock = threading.Lock()     # 多個執行緒同時呼叫 call()，計數器要加鎖
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    def call(self, fn, *args, **kwargs):
+        """
+        在期限內呼叫 fn(*args, **kwargs)，回傳第一個成功的結果
+        回傳或丟出錯誤前會等這次送出的請求都結束（輸掉的對沖請求除外），
+        呼叫端（例如 /ask 的排程名額）釋放時，上游也真的沒有這個請求在跑了
+        """
+        self._count("calls")
+        self.retry_budget.deposit()
+        deadline = time.monotonic() + self.deadline
+        started = []    # 這次呼叫送出的請求
+        try:
+            return self._call(fn, args, kwargs, deadline, started)
+        finally:
+            wait(started)   # 每個請求都帶著自己的逾時，最晚在期限附近結束
+
+    def _call(self, fn, args, kwargs, deadline, started):
+        attempt = 1
+        while True:
+            # 剩餘時間平均分給還能嘗試的次數（重試預算用完時，這次就是最後一次）
+            attempts_left = min(self.max_attempts - attempt + 1, 1 + self.retry_budget.available())
+            attempt_deadline = time.monotonic() + (deadline - time.monotonic()) / attempts_left
+            try:
+                return self._attempt(fn, args, kwargs, attempt_deadline, started)
+            except Exception as e:
+                backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1)))
+                if (attempt >= self.max_attempts or not is_retryable(e) or time.monotonic() + backoff >= deadline
+                        or not self.retry_budget.withdraw()):
+                    if is_timeout(e):
+                        self._count("timeouts")
+                        raise StageTimeout(self.name, f"{self.name} 超過 {self.deadline} 秒仍沒有回應") from e
+                    raise
+                time.sleep(backoff)
+                self._count("retries")
+                attempt += 1
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _submit(self, fn, args, kwargs, attempt_deadline, started):
+        start = time.monotonic()
+        if self.timeout_arg:
+            kwargs = {**kwargs, self.timeout_arg: max(0.1, attempt_deadline - start)}
+        future = self._executor.submit(fn, *args, **kwargs)
+        started.append(future)
+
+        def record(f):
+            if not f.cancelled() and f.exception() is None:
+                self.latency.record(time.monotonic() - start)   # 被放棄的慢請求完成後也要記錄，延遲分佈才準確
+        future.add_done_callback(record)
+        return future
+
+    def _attempt(self, fn, args, kwargs, deadline, started):
+        """一次嘗試（可能包含一個對沖請求），回傳先成功的結果；超過 deadline 丟出 AttemptTimeout"""
+        pending = {self._submit(fn, args, kwargs, deadline, started)}
+        hedge = None
+
+        threshold = self.latency.percentile(self.hedge_percentile) if self.hedge_percentile else None
+        if threshold is not None:
+            done, _ = wait(pending, timeout=min(threshold, max(0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline and self.retry_budget.withdraw():
+                hedge = self._submit(fn, args, kwargs, deadline, started)
+                pending.add(hedge)
+                self._count("hedges")
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    for other in pending:
+                        other.cancel()          # 尚未開始執行的就不用送出；已經送出的結果會被丟棄
+                        started.remove(other)   # 輸掉的對沖請求不等它結束
+                    return future.result()
+                error = future.exception()
+                # 另一個請求還在跑時，失敗的這個立刻補送一次，不必等慢的那個逾時
+                if pending and is_retryable(error) and self.retry_budget.withdraw():
+                    pending.add(self._submit(fn, args, kwargs, deadline, started))
+                    self._count("retries")
+
+        if pending or error is None:
+            raise AttemptTimeout(f"{self.name} 單次嘗試逾時")
+        raise error
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            counters = {
+                "calls": self.calls,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "timeouts": self.timeouts,
+            }
+        return {
+            "deadline": self.deadline,
+            **counters,
+            "hedge_threshold": self.latency.percentile(self.hedge_percentile) if self.hedge_percentile else None,
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+        }
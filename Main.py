@@ -1,12 +1,96 @@
 import os
+import sys
+import json
+import argparse
 import asyncio
-from RAG_Helper import RAGHelper
+from RAG_Helper import RAGHelper, normalize_question
 from dotenv import load_dotenv
 
 # 載入 .env 檔案
 load_dotenv()
 
-async def main():
+
+def read_questions(input_path):
+    """讀取 JSONL 題庫，每行格式為 {"id": 可選, "question": "..."}，相同的問題只保留一題"""
+    questions = {}  # 正規化後的問題 -> {"question": 原始問題, "ids": [...]}
+    with open(input_path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            question = str(item.get("question", "")).strip()
+            if not question:
+                print(f"第 {line_no} 行沒有 question，略過")
+                continue
+            entry = questions.setdefault(normalize_question(question), {"question": question, "ids": []})
+            if "id" in item:
+                entry["ids"].append(item["id"])
+    return questions
+
+
+def read_finished(output_path):
+    """讀取已經寫出的結果（檢查點），回傳已回答的問題集合"""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:    # 上次中斷時寫到一半的行
+                continue
+            if "answer" in item:
+                finished.add(normalize_question(item["question"]))
+    return finished
+
+
+def run_bulk(rag, input_path, output_path, concurrency=4, chunk_size=32):
+    """
+    批次回答題庫：JSONL 讀入、JSONL 寫出
+    每處理完一批就寫入輸出檔，程式中斷後以相同參數重新執行會跳過已經回答過的問題
+    輸出檔只寫入成功的回答（每題一筆），失敗的問題印在 stderr，重新執行時會再試一次
+    """
+    questions = read_questions(input_path)
+    finished = read_finished(output_path)
+    pending = [key for key in questions if key not in finished]
+    print(f"共 {len(questions)} 個不重複的問題，已完成 {len(questions) - len(pending)} 題，剩下 {len(pending)} 題")
+
+    done = 0
+    failed = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for start in range(0, len(pending), chunk_size):
+            keys = pending[start:start + chunk_size]
+            results = rag.ask_batch([questions[key]["question"] for key in keys], max_concurrency=concurrency)
+
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    print(f"回答失敗：{questions[key]['question']}（{result}）", file=sys.stderr)
+                    continue
+                answer, sources = result
+                record = {"question": questions[key]["question"]}
+                if questions[key]["ids"]:
+                    record["ids"] = questions[key]["ids"]
+                record["answer"] = answer
+                record["sources"] = [
+                    {
+                        "source": os.path.basename(str(doc.metadata.get('source', '未知來源'))),
+                        "page": doc.metadata.get('page', 0) + 1,
+                    }
+                    for doc in sources
+                ]
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            out.flush()
+            os.fsync(out.fileno())  # 確保這一批已寫入磁碟，當作檢查點
+            done += len(keys)
+            print(f"進度：{done}/{len(pending)}")
+
+    if failed:
+        print(f"有 {failed} 題回答失敗，請以相同指令重新執行再試一次", file=sys.stderr)
+
+
+async def main(args):
     # 檢查是否有設定 API 金鑰
     if not os.getenv("OPENAI_API_KEY"):
         print("錯誤：請在 .env 檔案中設定 OPENAI_API_KEY")
@@ -22,6 +106,12 @@ async def main():
         print("設置問答系統...")
         rag.setup_retrieval_chain()
 
+        if args.bulk:
+            output_path = args.output or os.path.splitext(args.bulk)[0] + "_answers.jsonl"
+            run_bulk(rag, args.bulk, output_path, concurrency=args.concurrency, chunk_size=args.chunk_size)
+            print(f"批次問答完成，結果已寫入 {output_path}")
+            return
+
         print("\n=== RAG 問答系統已準備就緒 ===")
         print("輸入問題開始對話，輸入 'quit'、'exit' 或 'q' 結束程式")
         print("=" * 50)
@@ -66,4 +156,9 @@ async def main():
 
 # 如果直接執行此檔案
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="RAG 問答系統（終端機版本）")
+    parser.add_argument("--bulk", metavar="INPUT", help="批次模式：讀取 JSONL 題庫，每行 {\"id\": 可選, \"question\": \"...\"}")
+    parser.add_argument("--output", metavar="OUTPUT", help="批次模式的輸出檔（JSONL），預設為 <INPUT>_answers.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時呼叫語言模型的數量（預設 4）")
+    parser.add_argument("--chunk-size", type=int, default=32, help="每批處理幾題，每批完成後寫入檢查點（預設 32）")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,328 @@
+"""
+用真的瀏覽器（Chrome / Chromium，透過 DevTools Protocol）量測首頁載入，比較：
+- 第三方套件從 CDN 載入（修改前的首頁：JS 用 defer，但兩個 CSS 會擋住畫面）
+- CDN 連不上（連線沒有回應，例如網路擋掉 CDN）
+- 第三方套件放在 static/vendor/（未建置）
+- Build_Static.py 建置後的版本（有 static/dist/ 時）
+CDN 由本機另一個 port 上的假伺服器模擬，內容就是 static/vendor/ 裡的檔案（gzip 傳輸），
+每條新連線額外延遲 --cdn-connect-ms，代表連到另一個網域要多做的 DNS 查詢與 TLS 交握
+
+每種情況都在停用快取、模擬慢速網路與較慢的 CPU 下載入 --runs 次，印出中位數：
+- FCP：第一次畫出內容的時間
+- 可互動時間：DOMContentLoaded 結束（defer 的 JS 都執行完）與最後一個長任務（>50ms）結束中較晚的一個
+
+執行方式：
+    python Page_Load_Benchmark.py                               # 自動尋找 Chrome / Chromium，以 headless 模式啟動
+    python Page_Load_Benchmark.py --chrome /path/to/chrome
+    python Page_Load_Benchmark.py --cdp http://127.0.0.1:9222   # 連到已經用 --remote-debugging-port 開著的瀏覽器
+需要安裝 websockets（pip install websockets）
+"""
+import os
+import json
+import time
+import gzip
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import posixpath
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse
+from starlette.routing import Mount, Route
+
+from Build_Static import STATIC_DIR, DIST_DIR, VENDOR_DIR, STATIC_URL, VENDOR_FILES
+from Static_Files import PrecompressedStaticFiles
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+CHROME_NAMES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome", "msedge"]
+CHROME_PATHS = [
+    r"C:\Program Files\Google\Chrome\Application\chrome.exe",
+    r"C:\Program Files (x86)\Microsoft\Edge\Application\msedge.exe",
+    "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+]
+
+# 記錄長任務結束的時間，每次載入頁面前注入
+LONG_TASK_OBSERVER = """
+window.__longTaskEnds = [];
+new PerformanceObserver(list => {
+    for (const entry of list.getEntries()) window.__longTaskEnds.push(entry.startTime + entry.duration);
+}).observe({type: 'longtask', buffered: true});
+"""
+READ_METRICS = """
+(() => {
+    const nav = performance.getEntriesByType('navigation')[0];
+    const fcp = performance.getEntriesByName('first-contentful-paint')[0];
+    return JSON.stringify({
+        fcp: fcp ? fcp.startTime : null,
+        dcl: nav && nav.domContentLoadedEventEnd > 0 ? nav.domContentLoadedEventEnd : null,
+        longTaskEnds: window.__longTaskEnds || [],
+    });
+})()
+"""
+
+
+class FakeCDNHandler(BaseHTTPRequestHandler):
+    """以 npm CDN 的路徑提供 static/vendor/ 裡的檔案；down 為 True 時接受連線但永遠不回應"""
+    protocol_version = "HTTP/1.1"
+    connect_delay = 0.0
+    down = False
+
+    def setup(self):
+        super().setup()
+        self.new_connection = True
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # 換頁時瀏覽器會中斷還沒完成的請求
+
+    def do_GET(self):
+        if self.down:
+            time.sleep(3600)
+            return
+        if self.new_connection:
+            time.sleep(self.connect_delay)
+            self.new_connection = False
+        path = vendor_path(self.path.lstrip("/"))
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        if not path.endswith(".woff2") and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", content_type(path))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")    # 字型跨網域載入需要
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def vendor_path(npm_path):
+    """npm 套件裡的路徑 -> static/vendor/ 裡的檔案（同一個目錄下的字型等相對路徑也對應過去）"""
+    for rel_path, package_path in VENDOR_FILES.items():
+        if npm_path == package_path:
+            return os.path.join(VENDOR_DIR, rel_path)
+        package_dir = posixpath.dirname(package_path) + "/"
+        if npm_path.startswith(package_dir):
+            return os.path.join(VENDOR_DIR, posixpath.dirname(rel_path), npm_path[len(package_dir):])
+    return None
+
+
+def content_type(path):
+    return {".js": "application/javascript", ".css": "text/css", ".woff2": "font/woff2"}.get(
+        os.path.splitext(path)[1], "application/octet-stream")
+
+
+def cdn_page(cdn_url):
+    """修改前的首頁：第三方套件改回從 CDN 載入，CSS 改回會擋住畫面的 <link>"""
+    with open(os.path.join(STATIC_DIR, "index.html"), encoding="utf-8") as f:
+        html = f.read()
+    html = html.replace(''' media="print" onload="this.media='all'"''', "")
+    for rel_path, npm_path in VENDOR_FILES.items():
+        html = html.replace(f'"{STATIC_URL}vendor/{rel_path}"', f'"{cdn_url}/{npm_path}"')
+    return html
+
+
+def start_cdn(connect_delay, down):
+    handler = type("Handler", (FakeCDNHandler,), {"connect_delay": connect_delay, "down": down})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_site(cdn_url, cdn_down_url):
+    """和 main_web.py 相同的方式提供 static/，另外加上兩個 CDN 版本的首頁"""
+    static_files = PrecompressedStaticFiles(directory=STATIC_DIR)
+
+    async def page(request):
+        name = request.path_params["name"]
+        if name == "cdn":
+            return HTMLResponse(cdn_page(cdn_url))
+        if name == "cdn-down":
+            return HTMLResponse(cdn_page(cdn_down_url))
+        return await static_files.get_response("dist/index.html" if name == "dist" else "index.html", request.scope)
+
+    app = Starlette(routes=[Route("/page/{name}", page), Mount("/static", static_files)])
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, log_level="error")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://localhost:{port}"
+
+
+def launch_chrome(path):
+    """以 headless 模式啟動 Chrome，回傳 (process, DevTools 網址)"""
+    user_data_dir = tempfile.mkdtemp(prefix="page-load-")
+    process = subprocess.Popen([path, "--headless=new", "--remote-debugging-port=0", f"--user-data-dir={user_data_dir}",
+                                "--no-first-run", "--no-default-browser-check", "about:blank"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+    for _ in range(200):
+        if os.path.exists(port_file):
+            with open(port_file) as f:
+                port = f.readline().strip()
+            if port:
+                return process, f"http://127.0.0.1:{port}"
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{path} 沒有開啟 DevTools")
+
+
+def find_chrome():
+    for name in CHROME_NAMES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return next((path for path in CHROME_PATHS if os.path.exists(path)), None)
+
+
+class DevTools:
+    """最簡單的 DevTools Protocol client：一次送一個指令，等待結果時順便收集事件"""
+    def __init__(self, ws):
+        self.ws = ws
+        self.next_id = 0
+        self.events = []
+
+    async def send(self, method, **params):
+        self.next_id += 1
+        await self.ws.send(json.dumps({"id": self.next_id, "method": method, "params": params}))
+        while True:
+            message = json.loads(await self.ws.recv())
+            if message.get("id") == self.next_id:
+                if "error" in message:
+                    raise RuntimeError(f"{method}：{message['error']}")
+                return message.get("result", {})
+            self.events.append(message.get("method"))
+
+    async def wait_event(self, method, timeout):
+        """等到事件發生回傳 True，超過 timeout 秒回傳 False"""
+        deadline = time.monotonic() + timeout
+        while method not in self.events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                message = json.loads(await asyncio.wait_for(self.ws.recv(), remaining))
+            except asyncio.TimeoutError:
+                return False
+            self.events.append(message.get("method"))
+        return True
+
+
+async def measure(devtools, url, timeout):
+    """冷快取載入一次，回傳 (FCP, 可互動時間)（毫秒），超過 timeout 還沒發生的是 None"""
+    for page_url in ("about:blank", url):   # 先換到空白頁，上一頁還沒結束的請求不會影響這次
+        devtools.events.clear()
+        await devtools.send("Page.navigate", url=page_url)
+        if page_url != url:
+            await devtools.wait_event("Page.loadEventFired", 5)
+    await devtools.wait_event("Page.loadEventFired", timeout)
+    await asyncio.sleep(0.5)    # 讓最後一個長任務被記錄下來
+    result = await devtools.send("Runtime.evaluate", expression=READ_METRICS, returnByValue=True)
+    metrics = json.loads(result["result"]["value"])
+    if metrics["dcl"] is None:
+        return metrics["fcp"], None
+    return metrics["fcp"], max([metrics["dcl"], metrics["fcp"] or 0, *metrics["longTaskEnds"]])
+
+
+async def run(cdp_url, scenarios, args):
+    with urllib.request.urlopen(f"{cdp_url}/json/list") as response:
+        targets = json.load(response)
+    ws_url = next(target["webSocketDebuggerUrl"] for target in targets if target["type"] == "page")
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        devtools = DevTools(ws)
+        await devtools.send("Page.enable")
+        await devtools.send("Network.enable")
+        await devtools.send("Network.setCacheDisabled", cacheDisabled=True)
+        await devtools.send("Network.emulateNetworkConditions", offline=False, latency=args.latency,
+                            downloadThroughput=args.download_kbps * 1000 / 8,
+                            uploadThroughput=args.upload_kbps * 1000 / 8)
+        await devtools.send("Emulation.setCPUThrottlingRate", rate=args.cpu_slowdown)
+        await devtools.send("Page.addScriptToEvaluateOnNewDocument", source=LONG_TASK_OBSERVER)
+
+        print(f"網路：延遲 {args.latency}ms、下載 {args.download_kbps}kbps；CPU 放慢 {args.cpu_slowdown} 倍；"
+              f"每種情況載入 {args.runs} 次取中位數，超過 {args.timeout:.0f} 秒視為未完成\n")
+        print(f"{'情況':<22}{'FCP':>10}{'可互動時間':>12}")
+        for label, url in scenarios:
+            fcps, ttis = [], []
+            for _ in range(args.runs):
+                fcp, tti = await measure(devtools, url, args.timeout)
+                fcps.append(fcp)
+                ttis.append(tti)
+            print(f"{label:<20}{median_text(fcps):>12}{median_text(ttis):>14}")
+
+
+def median_text(values):
+    if any(value is None for value in values):
+        return "未完成"
+    return f"{statistics.median(values):,.0f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用 Chrome 比較首頁從 CDN 載入與自架第三方套件的 FCP 與可互動時間")
+    parser.add_argument("--chrome", help="Chrome / Chromium 執行檔的路徑（預設自動尋找）")
+    parser.add_argument("--cdp", help="已經開著的瀏覽器的 DevTools 網址，例如 http://127.0.0.1:9222")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=20.0, help="每次載入最多等幾秒")
+    parser.add_argument("--latency", type=float, default=150, help="模擬的網路延遲（毫秒）")
+    parser.add_argument("--download-kbps", type=float, default=1600)
+    parser.add_argument("--upload-kbps", type=float, default=750)
+    parser.add_argument("--cpu-slowdown", type=float, default=4, help="CPU 放慢幾倍（模擬手機）")
+    parser.add_argument("--cdn-connect-ms", type=float, default=300, help="連到 CDN 的每條新連線額外延遲（毫秒）")
+    args = parser.parse_args()
+
+    if websockets is None:
+        raise SystemExit("請先安裝 websockets：pip install websockets")
+
+    cdn = start_cdn(args.cdn_connect_ms / 1000, down=False)
+    cdn_down = start_cdn(0, down=True)
+    site, site_url = start_site(f"http://127.0.0.1:{cdn.server_port}", f"http://127.0.0.1:{cdn_down.server_port}")
+    scenarios = [
+        ("CDN（修改前）", f"{site_url}/page/cdn"),
+        ("CDN 連不上", f"{site_url}/page/cdn-down"),
+        ("static/vendor/", f"{site_url}/page/static"),
+    ]
+    if os.path.exists(os.path.join(DIST_DIR, "index.html")):
+        scenarios.append(("建置後（static/dist/）", f"{site_url}/page/dist"))
+    else:
+        print("提示：先執行 python Build_Static.py 可以一起量測建置後的版本")
+
+    process = None
+    cdp_url = args.cdp
+    if cdp_url is None:
+        chrome = args.chrome or find_chrome()
+        if chrome is None:
+            raise SystemExit("找不到 Chrome / Chromium，請用 --chrome 指定執行檔或用 --cdp 連到已開啟的瀏覽器")
+        process, cdp_url = launch_chrome(chrome)
+    try:
+        asyncio.run(run(cdp_url.rstrip("/"), scenarios, args))
+    finally:
+        if process is not None:
+            process.kill()
+        site.should_exit = True
+        cdn.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import json
+import argparse
+import asyncio
+import sqlite3
+from collections import Counter
+import numpy as np
+from RAG_Helper import RAGHelper, normalize_question
+from dotenv import load_dotenv
+
+# 載入 .env 檔案
+load_dotenv()
+
+DB_PATH = 'rag_users.db'
+MAX_DISTINCT_QUESTIONS = 2000   # 只對最常出現的前 2000 種問題做分群，避免 embedding 費用過高
+EMBED_BATCH_SIZE = 256
+
+
+def create_tables(cursor):
+    """建立預先產生回答用的資料表（main_web.py 啟動時也會呼叫）"""
+    # 熱門問題群組的標準回答
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precomputed_answers (
+        question_key TEXT PRIMARY KEY,           -- 群組代表問題（正規化後）
+        question TEXT NOT NULL,                  -- 群組代表問題（原文，群組中最常出現的問法）
+        answer TEXT NOT NULL,                    -- 預先產生的回答
+        sources TEXT NOT NULL,                   -- 來源段落（JSON）
+        index_version TEXT NOT NULL,             -- 產生回答時的向量資料庫版本，版本不同就不會被使用
+        ask_count INTEGER DEFAULT 0,             -- 這個群組在紀錄中被問了幾次
+        served_count INTEGER DEFAULT 0,          -- /ask 直接回傳這個回答的次數
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    )
+    ''')
+
+    # 群組內的各種問法 -> 群組代表問題
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precomputed_aliases (
+        alias_key TEXT PRIMARY KEY,              -- 正規化後的問法
+        question_key TEXT NOT NULL,              -- 對應到 precomputed_answers.question_key
+        FOREIGN KEY(question_key) REFERENCES precomputed_answers(question_key)
+    )
+    ''')
+
+
+def load_question_counts(db_path, days=None):
+    """從 questions_log 統計每種問題（正規化後）出現的次數，以及最常見的原始問法"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    if days:
+        cursor.execute('''
+                       SELECT question FROM questions_log
+                       WHERE created_at >= datetime('now', 'localtime', ?)
+                       ''', (f"-{int(days)} days",))
+    else:
+        cursor.execute("SELECT question FROM questions_log")
+    rows = cursor.fetchall()
+    conn.close()
+
+    counts = Counter()
+    variants = {}   # 正規化後的問題 -> Counter(原始問法)
+    for (question,) in rows:
+        key = normalize_question(question)
+        if not key:
+            continue
+        counts[key] += 1
+        variants.setdefault(key, Counter())[question.strip()] += 1
+    return counts, variants
+
+
+def cluster_questions(keys, vectors, threshold):
+    """
+    貪婪分群：keys 已依出現次數由多到少排序，
+    每個問題和現有群組的代表問題比較 cosine 相似度，超過 threshold 就加入該群組，否則自成一群
+    回傳 [[群組內的 key, ...], ...]，每群的第一個 key 是代表問題
+    """
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    clusters = []
+    leaders = np.empty((0, vectors.shape[1]), dtype=np.float32)
+    for key, vector in zip(keys, vectors):
+        if len(clusters):
+            similarities = leaders @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                clusters[best].append(key)
+                continue
+        clusters.append([key])
+        leaders = np.vstack([leaders, vector])
+    return clusters
+
+
+def mine_frequent_questions(rag, db_path, top_n, days=None, threshold=0.9):
+    """找出最常被問的前 top_n 個問題群組，回傳 [(代表問題原文, [群組內的 key, ...], 出現次數), ...]"""
+    counts, variants = load_question_counts(db_path, days)
+    keys = [key for key, _ in counts.most_common(MAX_DISTINCT_QUESTIONS)]
+    if not keys:
+        return []
+
+    vectors = []
+    for start in range(0, len(keys), EMBED_BATCH_SIZE):
+        vectors.extend(rag.index_embeddings.embed_documents(keys[start:start + EMBED_BATCH_SIZE]))
+    clusters = cluster_questions(keys, np.array(vectors, dtype=np.float32), threshold)
+
+    groups = []
+    for members in clusters:
+        leader = members[0]
+        groups.append((variants[leader].most_common(1)[0][0], members, sum(counts[key] for key in members)))
+    groups.sort(key=lambda group: group[2], reverse=True)
+    return groups[:top_n]
+
+
+def precompute(rag, db_path=DB_PATH, top_n=50, days=None, threshold=0.9, concurrency=4):
+    """
+    產生熱門問題的標準回答並存入 precomputed_answers：
+    已經用目前向量資料庫版本產生過的回答會保留，其他（新的或資料庫變更後過期的）重新產生，
+    已經不在前 top_n 名的群組會被移除
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    create_tables(cursor)
+    conn.commit()
+
+    groups = mine_frequent_questions(rag, db_path, top_n, days, threshold)
+    print(f"找到 {len(groups)} 個熱門問題群組")
+
+    cursor.execute("SELECT question_key FROM precomputed_answers WHERE index_version = ?", (rag.index_version,))
+    up_to_date = {row[0] for row in cursor.fetchall()}
+    stale = [group for group in groups if group[1][0] not in up_to_date]
+    print(f"需要產生回答：{len(stale)} 個，沿用現有回答：{len(groups) - len(stale)} 個")
+
+    answers = rag.ask_batch([question for question, _, _ in stale], max_concurrency=concurrency) if stale else []
+    for (question, members, ask_count), result in zip(stale, answers):
+        if isinstance(result, Exception):
+            print(f"產生回答失敗：{question}（{result}）")
+            continue
+        answer, sources = result
+        formatted_sources = [
+            {
+                "source": os.path.basename(str(doc.metadata.get('source', '未知來源'))),
+                "page": doc.metadata.get('page', 0) + 1,
+                "content_preview": doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content
+            }
+            for doc in sources
+        ]
+        cursor.execute('''
+                       INSERT OR REPLACE INTO precomputed_answers
+                       (question_key, question, answer, sources, index_version, ask_count)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       ''', (members[0], question, answer, json.dumps(formatted_sources, ensure_ascii=False),
+                             rag.index_version, ask_count))
+
+    # 更新出現次數，並重建別名表、移除已經不熱門的群組
+    for question, members, ask_count in groups:
+        cursor.execute("UPDATE precomputed_answers SET ask_count = ? WHERE question_key = ?", (ask_count, members[0]))
+    cursor.execute("DELETE FROM precomputed_aliases")
+    cursor.executemany('''
+                       INSERT OR IGNORE INTO precomputed_aliases (alias_key, question_key)
+                       SELECT ?, question_key FROM precomputed_answers WHERE question_key = ?
+                       ''', [(key, members[0]) for _, members, _ in groups for key in members])
+    keep = [members[0] for _, members, _ in groups]
+    cursor.execute(f"DELETE FROM precomputed_answers WHERE question_key NOT IN ({','.join('?' * len(keep))})", keep)
+
+    conn.commit()
+    conn.close()
+
+
+async def main(args):
+    if not os.getenv("OPENAI_API_KEY"):
+        print("錯誤：請在 .env 檔案中設定 OPENAI_API_KEY")
+        return
+    if not os.path.exists(args.db):
+        print(f"錯誤：找不到資料庫 {args.db}")
+        return
+
+    rag = RAGHelper(pdf_folder="./pdfFiles", chunk_size=300, chunk_overlap=50)
+    await rag.load_and_prepare(['.pdf', '.txt', '.docx', '.md', '.csv'])
+    rag.setup_retrieval_chain()
+
+    precompute(rag, args.db, top_n=args.top, days=args.days, threshold=args.similarity, concurrency=args.concurrency)
+    print("熱門問題回答已更新")
+
+
+# 建議用排程（例如 cron）定期執行，例如每天凌晨：0 3 * * * cd <專案目錄> && python Precompute_Answers.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="從 questions_log 找出熱門問題並預先產生回答")
+    parser.add_argument("--top", type=int, default=50, help="保留前幾個熱門問題群組（預設 50）")
+    parser.add_argument("--days", type=int, default=None, help="只統計最近幾天的問題（預設全部）")
+    parser.add_argument("--similarity", type=float, default=0.9, help="兩個問題視為同一群組的 cosine 相似度門檻（預設 0.9）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時呼叫語言模型的數量（預設 4）")
+    parser.add_argument("--db", default=DB_PATH, help="資料庫檔案（預設 rag_users.db）")
+    asyncio.run(main(parser.parse_args()))
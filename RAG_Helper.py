@@ -1,14 +1,21 @@
 #import asyncio
 import glob  # 用來找多個檔案
+import hashlib
 import os
+import re
+import unicodedata
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 #langchain 相關套件
 from langchain.text_splitter import RecursiveCharacterTextSplitter  #切割文字
 from langchain_community.vectorstores import FAISS                  # FAISS : Facebook 開發的向量資料庫，用來做快速相似度搜尋。
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI           # embeddings 用來將文字轉換成向量
-from langchain.chains import create_retrieval_chain                 #建立 RAG 架構中的「檢索＋問答」流程。
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain   #把檢索到的段落和問題組成提示詞交給語言模型
 from langchain_core.prompts import ChatPromptTemplate
+from Latency_Policy import CallPolicy, LLM_DEADLINE, EMBED_DEADLINE
 
 #可以讀取不同的檔案格式
 from langchain_community.document_loaders import (
@@ -17,13 +24,36 @@ from langchain_community.document_loaders import (
     UnstructuredMarkdownLoader,
 )
 
+FAISS_INDEX_DIR = "my_faiss_index"     # 本地向量資料庫的資料夾
+
+
+def normalize_question(question: str) -> str:
+    """把問題正規化（全形轉半形、小寫、去掉多餘空白與結尾標點），用來判斷兩個問題是否相同"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?？!！。.～~ ")
+
+
 class RAGHelper:
+    QUERY_CACHE_SIZE = 1024     # 最多快取幾個問題的向量
+
     def __init__(self, pdf_folder, chunk_size=300, chunk_overlap=50):    #__init__ 是 python 的建構子
         self.pdf_folder = pdf_folder    # 儲存 PDF 檔案的 PATH
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.vectorstore = None
-        self.retrieval_chain = None
+        self.llm = None
+        self.prompt = None
+        self.k = 5                  # 每個問題檢索幾個段落（檢索和問答都用這個值）
+        self.index_version = None   # 向量資料庫的指紋，資料庫重建後會改變
+        # 建立向量資料庫等離線的大量向量化使用 client 預設的逾時與重試
+        self.index_embeddings = OpenAIEmbeddings(model="text-embedding-3-small") # 或是 model="text-embedding-3-large"
+        # 查詢時的問題向量化：逾時與重試交給 CallPolicy 控制，所以關閉 client 本身的重試（模型必須和上面相同）
+        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small", timeout=EMBED_DEADLINE, max_retries=0)
+        self.embed_policy = CallPolicy("embedding", deadline=EMBED_DEADLINE)
+        self.llm_policy = CallPolicy("llm", deadline=LLM_DEADLINE)
+        self._query_vectors = OrderedDict()     # 問題 -> 向量 的 LRU 快取，重複的問題不用再呼叫 embedding API
+        self._query_vectors_lock = threading.Lock()
 
     def get_loader(self,path: str):
         ext = Path(path).suffix.lower()
@@ -63,17 +93,16 @@ class RAGHelper:
 
     def _build_vectorstore(self, documents):
         print(f"建立向量資料庫... 共 {len(documents)} 個段落")
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small") # 或是 model="text-embedding-3-large"
-        self.vectorstore = FAISS.from_documents(documents, embeddings)
+        self.vectorstore = FAISS.from_documents(documents, self.index_embeddings)
 
     async def load_and_prepare(self, file_extensions=None):
         print("開始載入檔案...")
 
-        if os.path.exists("my_faiss_index"):    #如果本地有向量資料庫，載入本地的向量資料庫
+        if os.path.exists(FAISS_INDEX_DIR):    #如果本地有向量資料庫，載入本地的向量資料庫
             print("已偵測到現有向量資料庫，直接載入...")
             self.vectorstore = FAISS.load_local(
-                "my_faiss_index",
-                OpenAIEmbeddings(model="text-embedding-3-small"),
+                FAISS_INDEX_DIR,
+                self.index_embeddings,
                 allow_dangerous_deserialization=True
             )
 
@@ -112,17 +141,25 @@ class RAGHelper:
                 raise ValueError("沒有成功載入任何文件")
 
             self._build_vectorstore(all_chunks)  # 將文字轉成向量，並建立向量資料庫
-            self.vectorstore.save_local("my_faiss_index")   #將向量資料庫存到本地
+            self.vectorstore.save_local(FAISS_INDEX_DIR)   #將向量資料庫存到本地
+
+        self.index_version = self._compute_index_version()
+
+    def _compute_index_version(self):
+        """用向量資料庫檔案內容的雜湊值當作版本，教材或切割方式改變後版本就會不同"""
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(FAISS_INDEX_DIR)):
+            with open(os.path.join(FAISS_INDEX_DIR, name), "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()[:16]
 
     def setup_retrieval_chain(self):
         if not self.vectorstore:
             raise ValueError("請先執行 load_and_prepare()")
 
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.3)
-        # 創建檢索器
-        retriever = self.vectorstore.as_retriever(
-            search_kwargs={"k": 5}  # 只取前5個最相關的段落
-        )
+        # 每次呼叫的逾時由 llm_policy 決定，這裡的 timeout 只是上限
+        self.llm = ChatOpenAI(model="gpt-4o", temperature=0.3, timeout=LLM_DEADLINE, max_retries=0)
         # 創建提示詞模板
         system_prompt = (
             "你是一個基於 RAG 系統的計算機概論家教。請參考以下提供的內容來回答問題。"
@@ -134,49 +171,133 @@ class RAGHelper:
             "請用繁體中文回答。\n\n"
             "{context}"
         )
-        prompt = ChatPromptTemplate.from_messages([
+        self.prompt = ChatPromptTemplate.from_messages([
             ("system", system_prompt),
             ("human", "{input}"),
         ])
-        # 創建文檔合併鏈
-        question_answer_chain = create_stuff_documents_chain(llm, prompt)
-        # 創建檢索鏈
-        self.retrieval_chain = create_retrieval_chain(retriever, question_answer_chain)
+        self.k = 5  # 只取前5個最相關的段落
+
+    def _embed_queries(self, queries):
+        """把多個問題轉成向量，沒快取過的問題一次送出（只呼叫一次 embedding API，呼叫時不持有快取的鎖）"""
+        unique = list(dict.fromkeys(queries))
+        with self._query_vectors_lock:
+            vectors = {q: self._query_vectors[q] for q in unique if q in self._query_vectors}
+        missing = [q for q in unique if q not in vectors]
+        if missing:
+            vectors.update(zip(missing, self.embed_policy.call(self.embeddings.embed_documents, missing)))
+        with self._query_vectors_lock:
+            for q in unique:
+                self._query_vectors[q] = vectors[q]
+                self._query_vectors.move_to_end(q)
+            while len(self._query_vectors) > self.QUERY_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return np.array([vectors[q] for q in queries], dtype=np.float32)
+
+    def search_batch(self, queries, k=5):
+        """
+        只做檢索、不呼叫語言模型：多個問題一次向量化，再用一次 FAISS 搜尋取出每個問題的前 k 個段落
+        回傳 list，每個元素是該問題的 [(Document, 距離分數), ...]，分數越小越相關
+        """
+        if not self.vectorstore:
+            raise ValueError("請先執行 load_and_prepare()")
+        if not queries:
+            return []
+
+        vectors = self._embed_queries(queries)
+        distances, indices = self.vectorstore.index.search(vectors, k)
+
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            hits = []
+            for distance, i in zip(row_distances, row_indices):
+                if i == -1:     # 資料庫段落數不足 k 個
+                    continue
+                doc_id = self.vectorstore.index_to_docstore_id[int(i)]
+                hits.append((self.vectorstore.docstore.search(doc_id), float(distance)))
+            results.append(hits)
+        return results
+
+    def search(self, query, k=5):
+        """單一問題的檢索，回傳 [(Document, 距離分數), ...]"""
+        return self.search_batch([query], k)[0]
+
+    def _generate(self, query, docs):
+        """把問題和檢索到的段落交給語言模型（有期限、重試與對沖請求）"""
+        return self.llm_policy.call(self._invoke_llm, self.llm, self.prompt, query, docs)
+
+    def _invoke_llm(self, llm, prompt, query, docs, timeout):
+        """呼叫一次語言模型，timeout 是 llm_policy 分配給這次嘗試的秒數"""
+        chain = create_stuff_documents_chain(llm.bind(timeout=timeout), prompt)   # 文檔合併鏈
+        return chain.invoke({"input": query, "context": docs})
+
+    def _retrieve_and_generate(self, query):
+        docs = [doc for doc, _ in self.search(query, k=self.k)]    #檢索階段：embedding 呼叫有自己的期限與重試
+        return self._generate(query, docs), docs    # 語言模型給的答案，以及檢索到的原始段落
 
     def ask(self, query):
-        if not self.retrieval_chain:
+        if not self.llm:
             raise ValueError("請先執行 setup_qa_chain()")
         try:
-            result = self.retrieval_chain.invoke({"input": query})    #將使用者的問題傳給問答鏈，鏈內部會檢索並將檢索到的段落和問題交給大語言模型
-            return result["answer"], result["context"]     # result["answer"] 是 語言模型給的答案，result["context"]  是檢索到的原始段落
+            return self._retrieve_and_generate(query)
         except Exception as e:
             if "max_tokens_per_request" in str(e):
                 print("內容過長，嘗試使用較短的上下文...")
                 self.setup_retrieval_chain_with_shorter_context()
-                result = self.retrieval_chain.invoke({"input": query})
-                return result["answer"], result["context"]
+                return self._retrieve_and_generate(query)
             else:
                 raise e
 
+    def latency_stats(self):
+        """各階段的重試、對沖與逾時次數"""
+        return {"embedding": self.embed_policy.stats(), "llm": self.llm_policy.stats()}
+
+    def ask_batch(self, questions, max_concurrency=4):
+        """
+        一次回答多個問題：相同的問題只回答一次，所有問題一次向量化並批次檢索，
+        再以最多 max_concurrency 個同時進行的請求呼叫語言模型
+        回傳與 questions 順序相同的 list，每個元素是 (answer, sources)；該題失敗時則是 Exception
+        """
+        if not self.llm:
+            raise ValueError("請先執行 setup_retrieval_chain()")
+
+        unique = {}     # 正規化後的問題 -> 第一次出現的原始問題
+        for q in questions:
+            unique.setdefault(normalize_question(q), q)
+        keys = list(unique)
+        if not keys:
+            return []
+
+        hits = self.search_batch([unique[key] for key in keys], k=self.k)
+        contexts = [[doc for doc, _ in doc_hits] for doc_hits in hits]
+
+        def generate(key, docs):
+            try:
+                return self._generate(unique[key], docs)
+            except Exception as e:     # 單題失敗不影響其他題
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            answers = list(pool.map(generate, keys, contexts))
+
+        results = {}
+        for key, answer, docs in zip(keys, answers, contexts):
+            results[key] = answer if isinstance(answer, Exception) else (answer, docs)
+        return [results[normalize_question(q)] for q in questions]
+
     def setup_retrieval_chain_with_shorter_context(self):
         """設置更短上下文的檢索鏈"""
         if not self.vectorstore:
             raise ValueError("請先執行 load_and_prepare()")
 
-        llm = ChatOpenAI(model="gpt-4o", temperature=0.0)
-        # 更嚴格的檢索配置
-        retriever = self.vectorstore.as_retriever(
-            search_kwargs={"k": 3}
-        )
+        self.llm = ChatOpenAI(model="gpt-4o", temperature=0.0, timeout=LLM_DEADLINE, max_retries=0)
         system_prompt = (
             "你是一個問答助手。基於以下提供的內容來回答問題。"
             "如果內容中沒有相關資訊，請說「根據提供的資料無法回答這個問題」。"
             "請用繁體中文簡潔回答。\n\n"
             "{context}"
         )
-        prompt = ChatPromptTemplate.from_messages([
+        self.prompt = ChatPromptTemplate.from_messages([
             ("system", system_prompt),
             ("human", "{input}"),
         ])
-        question_answer_chain = create_stuff_documents_chain(llm, prompt)
-        self.retrieval_chain = create_retrieval_chain(retriever, question_answer_chain)
\ No newline at end of file
+        self.k = 3  # 更嚴格的檢索配置
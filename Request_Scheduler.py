@@ -0,0 +1,191 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class SchedulerRejected(Exception):
+    """請求被排程器拒絕（限流或系統過載），由 API 轉成 429 / 503 回應"""
+    def __init__(self, status_code: int, detail: str, retry_after: float = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def headers(self):
+        if self.retry_after is None:
+            return None
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    """每位使用者一個令牌桶：平均每秒補充 rate 個令牌，最多累積 capacity 個（允許短暫連發）"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """成功取得令牌回傳 0，否則回傳還要等幾秒才會有下一個令牌"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """請求沒有被執行（例如等待逾時）時把令牌還回去"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class RequestScheduler:
+    """
+    放在 RAGHelper.ask 前面的准入控制：
+    - 全域同時執行上限 max_concurrent，避免把模型額度塞爆
+    - 每位使用者一個令牌桶，超過速率直接回 429
+    - 有上限的等待佇列，依使用者輪流（round-robin）放行，避免單一使用者佔滿佇列
+    - 佇列已滿或等待逾時直接回 503，而不是讓請求卡到逾時
+    """
+    MAX_BUCKETS = 10000     # 令牌桶數量超過此值時，清掉已經補滿（閒置）的桶
+
+    def __init__(self, max_concurrent=4, max_queue=32, queue_timeout=15.0, user_rate=0.2, user_burst=3):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+
+        self._in_flight = 0
+        self._queue_depth = 0
+        self._waiting = OrderedDict()   # user_id -> deque[Future]，順序即輪流放行的順序
+        self._buckets = {}              # user_id -> TokenBucket
+
+        self.admitted = 0
+        self.rejected_rate_limited = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def _bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self._buckets = {uid: b for uid, b in self._buckets.items() if not b.is_full()}
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets[user_id] = bucket
+        return bucket
+
+    async def acquire(self, user_id: str):
+        """取得一個執行名額；被拒絕時丟出 SchedulerRejected"""
+        # 先確認有空位或佇列還有位置，被 503 拒絕的請求不會用掉使用者的提問額度
+        has_slot = self._in_flight < self.max_concurrent and self._queue_depth == 0
+        if not has_slot and self._queue_depth >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise SchedulerRejected(503, "系統忙碌中，請稍後再試", retry_after=self.queue_timeout)
+
+        bucket = self._bucket(user_id)
+        wait = bucket.try_take()
+        if wait > 0:
+            self.rejected_rate_limited += 1
+            raise SchedulerRejected(429, "提問太頻繁，請稍後再試", retry_after=wait)
+
+        # 有空位且沒有人在排隊 → 直接執行
+        if has_slot:
+            self._in_flight += 1
+            self.admitted += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        self._queue_depth += 1
+
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # 使用者中斷連線：若剛好已被放行要把名額還回去
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._remove_waiter(user_id, future)
+            raise
+
+        if not future.done():
+            self._remove_waiter(user_id, future)
+            bucket.refund()
+            self.rejected_timeout += 1
+            raise SchedulerRejected(503, "系統忙碌中，等待逾時，請稍後再試", retry_after=self.queue_timeout)
+
+        self.admitted += 1
+
+    def acquire_extra(self, count: int) -> int:
+        """
+        已經用 acquire() 取得一個名額後，再立刻拿最多 count 個空閒名額（不排隊、不扣令牌），
+        用於一次會同時呼叫多次語言模型的請求（例如批次問答），回傳實際拿到的數量
+        """
+        granted = 0
+        while granted < count and self._in_flight < self.max_concurrent and self._queue_depth == 0:
+            self._in_flight += 1
+            granted += 1
+        return granted
+
+    def release(self, count: int = 1):
+        """釋放名額，並依輪流順序放行下一位等待中的使用者"""
+        self._in_flight -= count
+        self._dispatch()
+
+    def _remove_waiter(self, user_id: str, future):
+        queue = self._waiting.get(user_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._queue_depth -= 1
+        if not queue:
+            del self._waiting[user_id]
+        future.cancel()
+
+    def _dispatch(self):
+        while self._in_flight < self.max_concurrent and self._waiting:
+            user_id, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            self._queue_depth -= 1
+            if queue:
+                self._waiting.move_to_end(user_id)  # 這位使用者排到最後，下一個名額給別人
+            else:
+                del self._waiting[user_id]
+            if future.done():
+                continue
+            future.set_result(None)
+            self._in_flight += 1
+
+    @asynccontextmanager
+    async def slot(self, user_id: str):
+        """用法：async with scheduler.slot(user_id): ..."""
+        await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """目前的佇列狀態與拒絕次數，用來調整容量設定"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queue_depth": self._queue_depth,
+            "waiting_users": len(self._waiting),
+            "admitted": self.admitted,
+            "rejected_rate_limited": self.rejected_rate_limited,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
@@ -0,0 +1,68 @@
+import os
+import mimetypes
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"     # 檔名帶雜湊的檔案內容永遠不會變，可以快取一年
+REVALIDATE_CACHE = "no-cache"                               # 每次都用 ETag 向伺服器確認，沒變就回 304
+
+# Accept-Encoding 名稱 -> Build_Static.py 產生的壓縮檔副檔名，依偏好順序排列
+PRECOMPRESSED = {"br": ".br", "gzip": ".gz"}
+# Accept 裡的圖片格式 -> Build_Static.py 產生的圖片副檔名
+IMAGE_VARIANTS = {"image/webp": ".webp"}
+
+
+def accepted_values(header: str) -> set:
+    """解析 Accept / Accept-Encoding，忽略 q=0 的項目"""
+    values = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        values.add(name.strip().lower())
+    return values
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    提供 static/ 檔案，並且：
+    - 瀏覽器支援時改送 Build_Static.py 預先壓縮好的 .br / .gz 檔，以及圖片的 .webp 版本
+    - static/dist/ 裡帶雜湊檔名的檔案使用長期快取，其他檔案（包含 index.html）每次用 ETag 重新確認
+    """
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        rel_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        response = None
+        if media_type.startswith("image/"):
+            vary = "Accept"
+            accepted = accepted_values(request_headers.get("accept", ""))
+            for image_type, suffix in IMAGE_VARIANTS.items():
+                variant_path = f"{full_path}{suffix}"
+                if image_type in accepted and os.path.isfile(variant_path):
+                    response = FileResponse(variant_path, status_code=status_code, media_type=image_type,
+                                            stat_result=os.stat(variant_path))
+                    break
+        else:
+            vary = "Accept-Encoding"
+            accepted = accepted_values(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in PRECOMPRESSED.items():
+                compressed_path = f"{full_path}{suffix}"
+                if encoding in accepted and os.path.isfile(compressed_path):
+                    response = FileResponse(compressed_path, status_code=status_code, media_type=media_type,
+                                            stat_result=os.stat(compressed_path))
+                    response.headers["Content-Encoding"] = encoding
+                    break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, media_type=media_type,
+                                    stat_result=stat_result)
+
+        response.headers["Vary"] = vary
+        hashed = rel_path.startswith("dist/") and rel_path not in ("dist/index.html", "dist/manifest.json")
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE if hashed else REVALIDATE_CACHE
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
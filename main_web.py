@@ -3,18 +3,22 @@ import asyncio
 import hashlib
 import jwt
 from datetime import datetime, timedelta, timezone
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import List, Optional
-from RAG_Helper import RAGHelper
+from RAG_Helper import RAGHelper, normalize_question
+from Request_Scheduler import RequestScheduler, SchedulerRejected
+from Precompute_Answers import create_tables as create_precomputed_tables
+from Latency_Policy import StageTimeout
 from dotenv import load_dotenv
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from Static_Files import PrecompressedStaticFiles
 import sqlite3
 import uuid
+import json
 from contextlib import asynccontextmanager
 
 
@@ -26,6 +30,22 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this") # JWT 加密
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30    #token 30 分鐘內有效
 
+# /ask 准入控制設定（可在 .env 調整）
+ASK_MAX_CONCURRENT = int(os.getenv("ASK_MAX_CONCURRENT", "4"))          # 全伺服器同時呼叫語言模型的上限
+ASK_MAX_QUEUE = int(os.getenv("ASK_MAX_QUEUE", "32"))                   # 等待佇列長度上限
+ASK_QUEUE_TIMEOUT = float(os.getenv("ASK_QUEUE_TIMEOUT", "15"))         # 在佇列中最多等幾秒
+ASK_USER_RATE = float(os.getenv("ASK_USER_RATE", "0.2"))                # 每位使用者每秒可提問幾次（0.2 = 每 5 秒一次）
+ASK_USER_BURST = int(os.getenv("ASK_USER_BURST", "3"))                  # 每位使用者可連續提問的次數
+
+# /search 檢索設定
+SEARCH_MAX_K = 20           # 每個問題最多回傳幾個段落
+SEARCH_MAX_BATCH = 64       # 批次檢索一次最多幾個問題
+
+# /ask/batch 批次問答設定
+BULK_MAX_QUESTIONS = 200                                        # 一次最多幾個問題
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))      # 批次問答時同時呼叫語言模型的數量（最多 ASK_MAX_CONCURRENT - 1）
+BULK_CHUNK_SIZE = 16                                            # 每批處理幾題，每批完成後寫入資料庫
+
 
 # 資料庫初始化
 def init_database():
@@ -61,7 +81,23 @@ def init_database():
     )
     ''')
 
-    conn.commit()   # 儲存這兩張表的建立動作
+    # 批次問答結果（檢查點），同一題在同一個向量資料庫版本下只需要產生一次
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_answers (
+        question_key TEXT NOT NULL,              -- 正規化後的問題
+        index_version TEXT NOT NULL,             -- 產生回答時的向量資料庫版本
+        question TEXT NOT NULL,                  -- 原始問題
+        answer TEXT NOT NULL,                    -- 回答內容
+        sources TEXT NOT NULL,                   -- 來源段落（JSON）
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        PRIMARY KEY (question_key, index_version)
+    )
+    ''')
+
+    # 熱門問題的預先產生回答（由 Precompute_Answers.py 定期產生）
+    create_precomputed_tables(cursor)
+
+    conn.commit()   # 儲存資料表的建立動作
     conn.close()    # 關閉連線
 
 
@@ -81,8 +117,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# 掛載 /static 用來提供 CSS、JS 檔案
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# 掛載 /static 用來提供 CSS、JS 檔案（支援預先壓縮的 .br / .gz、ETag 與長期快取）
+static_files = PrecompressedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
 
 # 設定 CORS
 app.add_middleware(
@@ -96,6 +133,15 @@ app.add_middleware(
 # 全域 RAG 實例
 rag_instance: Optional[RAGHelper] = None    #Optional[RAGHelper] 表示它可以是 RAGHelper，也可以是 None（尚未初始化）
 
+# 問答請求的排程器（全域同時執行上限 + 每位使用者限流 + 等待佇列）
+ask_scheduler = RequestScheduler(
+    max_concurrent=ASK_MAX_CONCURRENT,
+    max_queue=ASK_MAX_QUEUE,
+    queue_timeout=ASK_QUEUE_TIMEOUT,
+    user_rate=ASK_USER_RATE,
+    user_burst=ASK_USER_BURST,
+)
+
 # 安全相關
 security = HTTPBearer() #這是 FastAPI 用來處理 JWT token 驗證 的一個「安全機制」。
 
@@ -126,6 +172,32 @@ class AnswerResponse(BaseModel):
     answer: str         #	AI 回答的文字內容
     sources: List[dict] #	引用到的教材段落（清單格式，每一筆是字典）
 
+# 批次問答時送來的資料
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+
+# 批次問答結果：與 questions 順序相同，每筆包含 question、answer、sources、cached，失敗時則是 question、error
+class BatchAnswerResponse(BaseModel):
+    results: List[dict]
+    unique_questions: int   # 去除重複後的問題數
+    generated: int          # 這次實際呼叫語言模型回答的題數
+
+# 只做檢索（不產生回答）時送來的資料
+class SearchRequest(BaseModel):
+    question: str
+    k: int = 5      # 回傳前幾個最相關的段落
+
+class SearchBatchRequest(BaseModel):
+    questions: List[str]
+    k: int = 5
+
+# 檢索結果：每個段落包含 source、page、content_preview、score（距離，越小越相關）
+class SearchResponse(BaseModel):
+    results: List[dict]
+
+class SearchBatchResponse(BaseModel):
+    results: List[List[dict]]   # 與 questions 的順序相同
+
 # 用來統一表示 API 回傳的狀態（成功/失敗）
 class StatusResponse(BaseModel):
     status: str     #"success" 或 "error"
@@ -216,6 +288,68 @@ def log_question(user_id: str, question: str, answer: str, sources_count: int, r
     conn.commit()
     conn.close()
 
+#把檢索到的段落整理成前端要的格式
+def format_source(doc, score: float = None):
+    source_info = {
+        "source": os.path.basename(str(doc.metadata.get('source', '未知來源'))),
+        "page": doc.metadata.get('page', 0) + 1,
+        "content_preview": doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content
+    }
+    if score is not None:
+        source_info["score"] = round(score, 4)
+    return source_info
+
+#逾時的錯誤訊息要說出是哪個階段（問題向量化或語言模型）逾時
+STAGE_NAMES = {"embedding": "問題向量化", "llm": "語言模型"}
+
+def stage_timeout_detail(error: StageTimeout) -> str:
+    return f"{STAGE_NAMES.get(error.stage, error.stage)}回應逾時，請稍後再試"
+
+#讀取已經產生過的批次問答結果
+def get_batch_answers(question_keys: List[str], index_version: str):
+    conn = sqlite3.connect('rag_users.db')
+    cursor = conn.cursor()
+    answers = {}
+    for key in question_keys:
+        cursor.execute('''
+                       SELECT answer, sources FROM batch_answers
+                       WHERE question_key = ? AND index_version = ?
+                       ''', (key, index_version))
+        row = cursor.fetchone()
+        if row:
+            answers[key] = {"answer": row[0], "sources": json.loads(row[1])}
+    conn.close()
+    return answers
+
+#把一批批次問答結果存進資料庫
+def save_batch_answers(rows: list, index_version: str):
+    conn = sqlite3.connect('rag_users.db')
+    cursor = conn.cursor()
+    cursor.executemany('''
+                       INSERT OR REPLACE INTO batch_answers (question_key, index_version, question, answer, sources)
+                       VALUES (?, ?, ?, ?, ?)
+                       ''', [(key, index_version, question, answer, json.dumps(sources, ensure_ascii=False))
+                             for key, question, answer, sources in rows])
+    conn.commit()
+    conn.close()
+
+#查詢熱門問題是否已有預先產生的回答（必須是用目前的向量資料庫版本產生的）
+def get_precomputed_answer(question: str, index_version: str):
+    conn = sqlite3.connect('rag_users.db')
+    cursor = conn.cursor()
+    cursor.execute('''
+                   SELECT p.question_key, p.answer, p.sources
+                   FROM precomputed_aliases a
+                   JOIN precomputed_answers p ON p.question_key = a.question_key
+                   WHERE a.alias_key = ? AND p.index_version = ?
+                   ''', (normalize_question(question), index_version))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("UPDATE precomputed_answers SET served_count = served_count + 1 WHERE question_key = ?", (row[0],))
+        conn.commit()
+    conn.close()
+    return (row[1], json.loads(row[2])) if row else None
+
 def verify_admin(user_id: str):
     user = get_user_from_db(user_id=user_id)
     if not user or not user[7]:  # db_user[7] 是 is_admin
@@ -224,9 +358,11 @@ def verify_admin(user_id: str):
 # API 端點
 
 # 顯示首頁，這是網站的首頁 API，會回傳 static/index.html 給瀏覽器載入。
+# 有執行過 Build_Static.py 就回傳建置後的版本（引用帶雜湊檔名的檔案與本地第三方套件）
 @app.get("/", response_class=FileResponse)
-async def serve_index():
-    return FileResponse("static/index.html")
+async def serve_index(request: Request):
+    index_path = "dist/index.html" if os.path.exists("static/dist/index.html") else "index.html"
+    return await static_files.get_response(index_path, request.scope)
 
 
 # 使用者註冊（移除電子郵件）
@@ -339,28 +475,154 @@ async def ask_question(request: QuestionRequest, current_user: str = Depends(get
     if not rag_instance:
         raise HTTPException(status_code=400, detail="系統尚未初始化")
 
+    # 熱門問題已有預先產生的回答 → 直接回傳，不呼叫語言模型也不佔用排程名額
+    start_time = datetime.now()
+    precomputed = get_precomputed_answer(request.question, rag_instance.index_version)
+    if precomputed:
+        answer, formatted_sources = precomputed
+        response_time = (datetime.now() - start_time).total_seconds()
+        log_question(current_user, request.question, answer, len(formatted_sources), response_time)
+        return AnswerResponse(answer=answer, sources=formatted_sources)
+
+    try:
+        await ask_scheduler.acquire(current_user)   # 超過速率回 429，系統滿載回 503
+    except SchedulerRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers())
+
     try:
         start_time = datetime.now()
-        answer, sources = rag_instance.ask(request.question)
+        answer, sources = await asyncio.to_thread(rag_instance.ask, request.question)   # 在背景執行緒呼叫模型，不阻塞其他請求
         response_time = (datetime.now() - start_time).total_seconds()
 
         # 格式化來源資訊
-        formatted_sources = []
-        for doc in sources:
-            source_info = {
-                "source": os.path.basename(str(doc.metadata.get('source', '未知來源'))),
-                "page": doc.metadata.get('page', 0) + 1,
-                "content_preview": doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content
-            }
-            formatted_sources.append(source_info)
+        formatted_sources = [format_source(doc) for doc in sources]
 
         # 記錄問答
         log_question(current_user, request.question, answer, len(sources), response_time)
 
         return AnswerResponse(answer=answer, sources=formatted_sources)
 
+    except StageTimeout as e:
+        raise HTTPException(status_code=504, detail=stage_timeout_detail(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"回答問題時發生錯誤：{str(e)}")
+    finally:
+        ask_scheduler.release()
+
+
+# 批次問答（需要管理員權限），用來一次產生整份題庫的回答
+@app.post("/ask/batch", response_model=BatchAnswerResponse)
+async def ask_questions_batch(request: BatchQuestionRequest, current_user: str = Depends(get_current_user)):
+    """
+    批次回答問題：相同的問題只回答一次，已經回答過的問題直接從資料庫取出，
+    其餘每 BULK_CHUNK_SIZE 題一批產生回答並寫入資料庫，請求中斷後重送會從上次的進度繼續
+    """
+    global rag_instance
+    verify_admin(current_user)
+
+    if not rag_instance:
+        raise HTTPException(status_code=400, detail="系統尚未初始化")
+    if len(request.questions) > BULK_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"一次最多 {BULK_MAX_QUESTIONS} 個問題")
+
+    unique = {}     # 正規化後的問題 -> 第一次出現的原始問題
+    for question in request.questions:
+        if question.strip():
+            unique.setdefault(normalize_question(question), question)
+
+    index_version = rag_instance.index_version
+    answers = get_batch_answers(list(unique), index_version)
+    for entry in answers.values():
+        entry["cached"] = True
+    pending = [key for key in unique if key not in answers]
+
+    try:
+        await ask_scheduler.acquire(current_user)
+    except SchedulerRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers())
+    # 每個同時進行的語言模型呼叫都要佔一個名額，才不會超過全域上限；
+    # 批次最多佔 max_concurrent - 1 個名額，至少留一個給一般使用者的 /ask
+    bulk_slots = max(1, min(BULK_CONCURRENCY, ask_scheduler.max_concurrent - 1))
+    extra = 0
+
+    try:
+        for start in range(0, len(pending), BULK_CHUNK_SIZE):
+            keys = pending[start:start + BULK_CHUNK_SIZE]
+            # 額外的名額每批重新拿：上一批還回去時，排隊中的 /ask 會先被放行
+            extra = ask_scheduler.acquire_extra(bulk_slots - 1)
+            results = await asyncio.to_thread(
+                rag_instance.ask_batch, [unique[key] for key in keys], 1 + extra
+            )
+            ask_scheduler.release(extra)
+            extra = 0
+
+            rows = []
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    answers[key] = {"error": str(result)}
+                    continue
+                answer, sources = result
+                formatted_sources = [format_source(doc) for doc in sources]
+                answers[key] = {"answer": answer, "sources": formatted_sources, "cached": False}
+                rows.append((key, unique[key], answer, formatted_sources))
+            save_batch_answers(rows, index_version)     # 每批完成就存檔，當作檢查點
+
+    except StageTimeout as e:
+        raise HTTPException(status_code=504, detail=stage_timeout_detail(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批次問答時發生錯誤：{str(e)}")
+    finally:
+        ask_scheduler.release(1 + extra)
+
+    results = []
+    for question in request.questions:
+        entry = answers.get(normalize_question(question)) if question.strip() else {"error": "問題不能是空白"}
+        results.append({"question": question, **entry})
+
+    return BatchAnswerResponse(
+        results=results,
+        unique_questions=len(unique),
+        generated=sum(1 for key in pending if "answer" in answers.get(key, {}))
+    )
+
+
+# 只做檢索（需要登入），直接從向量資料庫回傳最相關的教材段落，不呼叫語言模型
+@app.post("/search", response_model=SearchResponse)
+async def search_sources(request: SearchRequest, current_user: str = Depends(get_current_user)):
+    """檢索相關段落（不產生回答）"""
+    results = await run_search([request.question], request.k)
+    return SearchResponse(results=results[0])
+
+
+# 批次檢索（需要登入），多個問題一次向量化、一次 FAISS 搜尋
+@app.post("/search/batch", response_model=SearchBatchResponse)
+async def search_sources_batch(request: SearchBatchRequest, current_user: str = Depends(get_current_user)):
+    """批次檢索相關段落"""
+    if len(request.questions) > SEARCH_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"一次最多檢索 {SEARCH_MAX_BATCH} 個問題")
+    results = await run_search(request.questions, request.k)
+    return SearchBatchResponse(results=results)
+
+
+async def run_search(questions: List[str], k: int):
+    """檢查參數後在背景執行緒做檢索，回傳格式化後的段落"""
+    global rag_instance
+
+    if not rag_instance:
+        raise HTTPException(status_code=400, detail="系統尚未初始化")
+    if not 1 <= k <= SEARCH_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k 必須介於 1 到 {SEARCH_MAX_K} 之間")
+    if any(not q.strip() for q in questions):
+        raise HTTPException(status_code=400, detail="問題不能是空白")
+
+    try:
+        hits_per_question = await asyncio.to_thread(rag_instance.search_batch, questions, k)
+    except StageTimeout as e:
+        raise HTTPException(status_code=504, detail=stage_timeout_detail(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"檢索時發生錯誤：{str(e)}")
+
+    return [[format_source(doc, score) for doc, score in hits] for hits in hits_per_question]
 
 
 # 使用者統計（需要登入），回傳目前登入的使用者在系統中的個人問答統計資料。取得目前登入者的 user_id（透過 get_current_user()）
@@ -450,6 +712,24 @@ async def get_admin_stats(current_user: str = Depends(get_current_user)):
     }
 
 
+# 管理員查看問答排程器狀態（佇列深度、拒絕次數），用來調整容量設定
+@app.get("/admin/scheduler")
+async def get_scheduler_stats(current_user: str = Depends(get_current_user)):
+    """問答排程器狀態"""
+    verify_admin(current_user)
+    return ask_scheduler.stats()
+
+
+# 管理員查看語言模型與 embedding 呼叫的重試、對沖與逾時次數
+@app.get("/admin/latency")
+async def get_latency_stats(current_user: str = Depends(get_current_user)):
+    """延遲控制狀態"""
+    verify_admin(current_user)
+    if not rag_instance:
+        raise HTTPException(status_code=400, detail="系統尚未初始化")
+    return rag_instance.latency_stats()
+
+
 @app.get("/status")
 async def get_status():
     """取得系統狀態"""
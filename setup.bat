@@ -77,6 +77,11 @@ pip install unstructured
 pip install python-dotenv
 pip install fastapi uvicorn python-multipart
 pip install PyJWT python-multipart email-validator pydantic[email]
+pip install Pillow brotli
+
+REM 建置網頁前端的靜態檔案（補下載遺失的第三方套件、壓縮、加上雜湊檔名）
+echo 🗜️ 正在建置網頁靜態檔案...
+python Build_Static.py --fetch
 
 REM 建立 .env 模板檔案
 if not exist ".env" (
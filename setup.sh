@@ -82,6 +82,11 @@ $PIP_CMD install unstructured
 $PIP_CMD install python-dotenv
 $PIP_CMD install fastapi uvicorn python-multipart
 $PIP_CMD install PyJWT python-multipart email-validator pydantic[email]
+$PIP_CMD install Pillow brotli
+
+# 建置網頁前端的靜態檔案（補下載遺失的第三方套件、壓縮、加上雜湊檔名）
+echo "🗜️ 正在建置網頁靜態檔案..."
+$PYTHON_CMD Build_Static.py --fetch
 
 # 建立 .env 模板檔案
 if [ ! -f ".env" ]; then